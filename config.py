@@ -1,18 +1,27 @@
-import os
-from pydantic_settings import BaseSettings
+from functools import lru_cache
+from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
-    
+    # в том же .env лежат и отладочные флаги (DebugSettings)
+    model_config = SettingsConfigDict(env_file=".env", extra="ignore")
+
     #db settings
-    DB_HOST: str = os.getenv("DB_HOST")
-    DB_PORT: int = os.getenv("DB_PORT")
-    DB_USER: str = os.getenv("DB_USER")
-    DB_PASS: str = os.getenv("DB_PASS")
-    DB_NAME: str = os.getenv("DB_NAME")
+    DB_HOST: str
+    DB_PORT: int
+    DB_USER: str
+    DB_PASS: str
+    DB_NAME: str
+
 
+class DebugSettings(BaseSettings):
+    """Отладочные флаги отдельно от настроек БД: их можно читать без DB_* в окружении"""
+    model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
+    # проверять собранные ответы полной валидацией pydantic (медленно, только для отладки)
+    DEBUG: bool = False
 
-    class Config:
-        env_file = ".env"
 
-settings = Settings()
\ No newline at end of file
+@lru_cache
+def get_settings() -> Settings:
+    """Читает окружение и .env один раз, при первом обращении"""
+    return Settings()
\ No newline at end of file
@@ -1,39 +1,79 @@
-from typing import Optional, List
+from typing import Dict, Optional, List
+from config import DebugSettings
 from models import Task
 from schemas import TaskSchema
 
-def task_to_schema(task: Task) -> TaskSchema:
-    """Конвертирует модель Task в схему TaskSchema"""
+# читается один раз при импорте; конвертерам не нужны настройки БД
+_DEBUG = DebugSettings().DEBUG
+
+# pydantic-core сериализует вложенные схемы рекурсивно и падает глубже 255 уровней,
+# один из которых в ответе GET /tasks занимает список; глубже деревья не строим (см. main)
+MAX_TREE_DEPTH = 254
+
+def task_to_schema(task: Task, nodes: Optional[Dict[int, Task]] = None) -> TaskSchema:
+    """Конвертирует модель Task в схему TaskSchema.
+
+    Дети берутся по id из `nodes` (плоский словарь поддерева из db.load_tree);
+    без него схема строится без детей.
+    Данные уже проверены на уровне БД, поэтому схема собирается через model_construct
+    без повторной валидации каждого узла дерева. С DEBUG=true дерево один раз
+    проверяется целиком от корня.
+    """
     if not task:
         return None
-    
-    return TaskSchema(
+
+    schema = _construct_schema(task, nodes or {})
+    if _DEBUG:
+        TaskSchema.model_validate(schema.model_dump())
+    return schema
+
+def _construct_schema(root: Task, nodes: Dict[int, Task]) -> TaskSchema:
+    """Собирает дерево схем обходом со стеком, без рекурсии: сборка не упирается в стек вызовов,
+    а `seen` защищает от циклов, если они есть в БД. Ответ всё равно ограничен MAX_TREE_DEPTH
+    уровнями: глубже не справляется сериализация pydantic."""
+    root_schema = _construct_node(root)
+    seen = {root.id}
+    stack = [(root, root_schema)]
+    while stack:
+        task, schema = stack.pop()
+        for child_id in task.childs:
+            child = nodes.get(child_id)
+            if child is None or child_id in seen:
+                continue
+            seen.add(child_id)
+            child_schema = _construct_node(child)
+            schema.childs.append(child_schema)
+            stack.append((child, child_schema))
+    return root_schema
+
+def _construct_node(task: Task) -> TaskSchema:
+    return TaskSchema.model_construct(
         id=task.id,
         title=task.title,
         description=task.description,
         status=task.status,
         updated=task.updated,
-        parent=task_to_schema(task.parent) if task.parent else None,
-        childs=[task_to_schema(child) for child in task.childs] if task.childs else []
+        parent=task.parent,
+        childs=[]
     )
 
-def tasks_to_schemas(tasks: List[Task]) -> List[TaskSchema]:
+def tasks_to_schemas(tasks: List[Task], nodes: Optional[Dict[int, Task]] = None) -> List[TaskSchema]:
     """Конвертирует список моделей Task в список схем TaskSchema"""
-    return [task_to_schema(task) for task in tasks] if tasks else []
+    return [task_to_schema(task, nodes) for task in tasks] if tasks else []
 
 def schema_to_task(schema: TaskSchema) -> Task:
     """Конвертирует схему TaskSchema в модель Task"""
     if not schema:
         return None
-    
+
     return Task(
         id=schema.id,
         title=schema.title,
         description=schema.description,
         status=schema.status,
         updated=schema.updated,
-        parent=schema_to_task(schema.parent) if schema.parent else None,
-        childs=[schema_to_task(child) for child in schema.childs] if schema.childs else []
+        parent=schema.parent,
+        childs=[child.id for child in schema.childs] if schema.childs else []
     )
 
 def schemas_to_tasks(schemas: List[TaskSchema]) -> List[Task]:
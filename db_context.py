@@ -1,49 +1,146 @@
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from typing import List, Optional, Set
-from contextlib import contextmanager
-from config import settings
+import asyncpg
+from cachetools import TTLCache
+from typing import Dict, List, Optional
+from contextlib import asynccontextmanager
+from config import get_settings
 from models import Task
 from datetime import datetime
 
+# Hot statements. asyncpg prepares each query server-side on first use per connection and then
+# reuses it from a cache keyed by the exact query text, so these are kept as shared constants.
+TASK_COLUMNS = "id, title, description, status, updated, parent, childs"
+SELECT_TASK = f"SELECT {TASK_COLUMNS} FROM tasks WHERE id = $1"
+SELECT_TASKS_BY_IDS = f"SELECT {TASK_COLUMNS} FROM tasks WHERE id = ANY($1::INT[])"
+SELECT_ROOTS = f"SELECT {TASK_COLUMNS} FROM tasks WHERE parent IS NULL"
+SELECT_SUBTREE = f"SELECT {TASK_COLUMNS} FROM tasks WHERE traversal_ids @> ARRAY[$1::INT]"
+SELECT_ROOT_TREES = (
+    f"SELECT {TASK_COLUMNS} FROM tasks WHERE traversal_ids[1] IN (SELECT id FROM tasks WHERE parent IS NULL)"
+)
+
+# every change to tasks is announced on this channel by the tasks_notify trigger
+TASKS_CHANNEL = "tasks_changed"
+# tree cache key for load_trees(); load_tree(id) is cached under the task id
+ROOT_TREES_KEY = "roots"
+
 class Database:
     """Simple DB context for tasks with parent/child relations and cycle protection.
 
-    Public methods:
+    All methods are coroutines. Public methods:
+      - connect() / close()
       - initialize()
       - insert_task(task)
       - get_tasks()  # root tasks (parent is NULL)
       - get_task(id)
+      - load_tree(id) / load_trees()  # subtrees as flat {id: Task}
       - delete_task_recursive(id)
       - toggle_task(id)
+      - is_descendant(ancestor_id, candidate_id)
+      - lock_tasks(ids, conn, ...)  # row locks for read-modify-write endpoints
       - _update_childs(id, childs)
     """
 
-    def __init__(self) -> None:
-        self._connection = None
-
-    def _get_connection(self):
-        if self._connection is None:
-            self._connection = psycopg2.connect(
+    def __init__(self, min_size: int = 2, max_size: int = 20, cache_size: int = 1024, cache_ttl: float = 60) -> None:
+        self._min_size = min_size
+        self._max_size = max_size
+        self._pool: Optional[asyncpg.Pool] = None
+        self._listener: Optional[asyncpg.Connection] = None
+        # loaded trees: task id (or ROOT_TREES_KEY) -> {id: Task}. Evicted on NOTIFY and on
+        # local commits; the TTL bounds staleness if a notification is ever missed.
+        self._cache: TTLCache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self._cache_generation = 0
+
+    async def connect(self) -> None:
+        """Create the connection pool and the LISTEN connection (no-op if already connected)."""
+        if self._pool is None:
+            settings = get_settings()
+            dsn = dict(
                 database=settings.DB_NAME,
                 user=settings.DB_USER,
                 password=settings.DB_PASS,
                 host=settings.DB_HOST,
                 port=settings.DB_PORT,
             )
-        return self._connection
-
-    @contextmanager
-    def _cursor(self):
-        conn = self._get_connection()
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            yield cur
-            conn.commit()
-
-    def initialize(self) -> None:
-        """Create tasks table (no-op if exists)."""
-        with self._cursor() as cur:
-            cur.execute(
+            self._pool = await asyncpg.create_pool(
+                **dsn,
+                min_size=self._min_size,
+                max_size=self._max_size,
+            )
+            self._listener = await asyncpg.connect(**dsn)
+            await self._listener.add_listener(TASKS_CHANNEL, self._on_tasks_changed)
+
+    async def close(self) -> None:
+        if self._listener is not None:
+            await self._listener.close()
+            self._listener = None
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+        self._invalidate()
+
+    # ---- tree cache ----
+    def _on_tasks_changed(self, conn, pid, channel, payload) -> None:
+        self._invalidate(int(payload))
+
+    def _invalidate(self, task_id: Optional[int] = None) -> None:
+        """Drop cached trees that contain `task_id`, or all of them if it is None."""
+        self._cache_generation += 1
+        if task_id is None:
+            self._cache.clear()
+            return
+        # a changed task may also be a new root, so the roots forest always goes
+        self._cache.pop(ROOT_TREES_KEY, None)
+        for key, nodes in list(self._cache.items()):
+            if task_id in nodes:
+                self._cache.pop(key, None)
+
+    async def _load_cached(self, key, conn, query: str, *args) -> Dict[int, Task]:
+        """Run a tree `query` through the cache. Reads inside a caller's transaction bypass it."""
+        if conn is None:
+            # single lookup: an entry may expire between `in` and [] on a TTLCache; misses are never stored
+            nodes = self._cache.get(key)
+            if nodes is not None:
+                return nodes
+
+        generation = self._cache_generation
+        async with self._connection(conn) as c:
+            records = await c.fetch(query, *args)
+        nodes = {r["id"]: self._build_task(r) for r in records}
+        # don't store a result that an invalidation may have overtaken, nor a miss
+        if conn is None and nodes and generation == self._cache_generation:
+            self._cache[key] = nodes
+        return nodes
+
+    @asynccontextmanager
+    async def _connection(self, conn=None):
+        """Borrow a pooled connection; reuse `conn` if the caller already holds one."""
+        if conn is not None:
+            yield conn
+            return
+
+        async with self._pool.acquire() as conn:
+            yield conn
+
+    @asynccontextmanager
+    async def transaction(self, conn=None):
+        """Yield a connection inside a transaction committed on exit and rolled back on error.
+
+        If `conn` is given, the caller's transaction is reused and nothing is committed here,
+        so nested helpers share one connection and one COMMIT.
+        """
+        if conn is not None:
+            yield conn
+            return
+
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                yield conn
+        # our own writes must be visible at once; NOTIFY reaches the listener only later
+        self._invalidate()
+
+    async def initialize(self) -> None:
+        """Create tasks table (no-op if exists), its indexes, the traversal_ids path column and the NOTIFY trigger."""
+        async with self.transaction() as conn:
+            await conn.execute(
                 """
                 CREATE TABLE IF NOT EXISTS tasks (
                     id SERIAL PRIMARY KEY,
@@ -54,186 +151,236 @@ class Database:
                     parent INT,
                     childs INT[]
                 );
+                ALTER TABLE tasks ADD COLUMN IF NOT EXISTS traversal_ids INT[];
+                CREATE INDEX IF NOT EXISTS tasks_traversal_gin ON tasks USING gin (traversal_ids);
+                -- partial index for the root listing, plain one for lookups by parent
+                CREATE INDEX IF NOT EXISTS tasks_parent_null ON tasks (id) WHERE parent IS NULL;
+                CREATE INDEX IF NOT EXISTS tasks_parent ON tasks (parent);
+
+                CREATE OR REPLACE FUNCTION tasks_notify() RETURNS trigger AS $$
+                BEGIN
+                    IF TG_OP = 'DELETE' THEN
+                        PERFORM pg_notify('tasks_changed', OLD.id::text);
+                    ELSE
+                        PERFORM pg_notify('tasks_changed', NEW.id::text);
+                    END IF;
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql;
+                CREATE OR REPLACE TRIGGER tasks_notify AFTER INSERT OR UPDATE OR DELETE ON tasks
+                    FOR EACH ROW EXECUTE FUNCTION tasks_notify();
                 """
             )
 
-    def insert_task(self, task: Task) -> Optional[Task]:
+            # backfill paths for rows created before traversal_ids existed
+            if await conn.fetchval("SELECT 1 FROM tasks WHERE traversal_ids IS NULL LIMIT 1"):
+                rows = await conn.fetch(
+                    """
+                    SELECT id FROM tasks t
+                    WHERE parent IS NULL OR NOT EXISTS (SELECT 1 FROM tasks p WHERE p.id = t.parent)
+                    """
+                )
+                await self._refresh_traversal_ids(conn, [r["id"] for r in rows])
+                # whatever is left is in (or hangs below) a parent cycle that no root reaches;
+                # break each cycle at its smallest id so those tasks stay loadable
+                while True:
+                    start = await conn.fetchval("SELECT min(id) FROM tasks WHERE traversal_ids IS NULL")
+                    if start is None:
+                        break
+                    await self._refresh_traversal_ids(conn, [start])
+
+    async def insert_task(self, task: Task, conn=None) -> Optional[Task]:
         """Insert a new task. If initial childs are provided, _update_childs will be called
         to set parent pointers and validate cycles.
         Returns the created Task or None on failure.
         """
-        childs_list = [child.id for child in task.childs] if task.childs else []
-        parent_id = task.parent.id if task.parent else None
-        with self._cursor() as cur:
-            cur.execute(
+        childs_list = list(task.childs or [])
+        parent_id = task.parent
+        async with self.transaction(conn) as conn:
+            row = await conn.fetchrow(
                 """
                 INSERT INTO tasks (title, description, status, updated, parent, childs)
-                VALUES (%s, %s, %s, %s, %s, %s)
+                VALUES ($1, $2, $3, $4, $5, $6)
                 RETURNING id, title, description, status, updated, parent, childs
                 """,
-                (task.title, task.description, task.status, getattr(task, 'updated', None), parent_id, childs_list),
+                task.title, task.description, task.status, getattr(task, 'updated', None), parent_id, childs_list,
             )
-            row = cur.fetchone()
             if not row:
                 return None
 
             created = self._build_task(row)
+            await self._refresh_traversal_ids(conn, [created.id])
 
             # If caller asked to attach childs immediately, ensure parents are set and cycles checked.
             if childs_list:
                 try:
-                    self._update_childs(created.id, childs_list)
-                except Exception:
+                    await self._update_childs(created.id, childs_list, conn)
+                except ValueError:
                     # rollback created row
-                    cur.execute("DELETE FROM tasks WHERE id = %s", (created.id,))
+                    await conn.execute("DELETE FROM tasks WHERE id = $1", created.id)
                     return None
 
             return created
 
-    def get_tasks(self) -> List[Task]:
-        """Return root tasks (parent IS NULL) as Task objects with children populated."""
-        with self._cursor() as cur:
-            cur.execute("SELECT id, title, description, status, updated, parent, childs FROM tasks WHERE parent IS NULL")
-            rows = cur.fetchall()
-            return [self._build_task(r) for r in rows]
-
-    def get_task(self, id: int, visited: Optional[Set[int]] = None) -> Optional[Task]:
-        """Return a single Task by id. Uses `visited` internally to avoid infinite recursion."""
-        if visited is None:
-            visited = set()
-        if id in visited:
-            return None
+    async def get_tasks(self) -> List[Task]:
+        """Return root tasks (parent IS NULL). Use load_trees() to get their subtrees."""
+        async with self._connection() as conn:
+            records = await conn.fetch(SELECT_ROOTS)
+            return [self._build_task(r) for r in records]
 
-        with self._cursor() as cur:
-            cur.execute("SELECT id, title, description, status, updated, parent, childs FROM tasks WHERE id = %s", (id,))
-            row = cur.fetchone()
-            return self._build_task(row, visited) if row else None
+    async def get_task(self, id: int, conn=None) -> Optional[Task]:
+        """Return a single Task by id; parent and childs are ids."""
+        async with self._connection(conn) as conn:
+            row = await conn.fetchrow(SELECT_TASK, id)
+            return self._build_task(row) if row else None
 
+    async def load_tree(self, id: int, conn=None) -> Dict[int, Task]:
+        """Return the subtree of `id` (itself included) as a flat {id: Task} dict, fetched in one query.
 
-
-
-    # def _build_task(self, row: dict, visited: Optional[Set[int]] = None) -> Task:
-    #     """
-    #     Создаёт Task из строки БД.
-    #     parent хранится как int, childs — список id.
-    #     """
-    #     if visited is None:
-    #         visited = set()
-
-    #     task_id = row["id"]
-    #     local_visited = set(visited)
-    #     local_visited.add(task_id)
-
-    #     childs_ids = row.get("childs") or []
-
-    #     parent_id = row.get("parent")
-
-    #     return Task(
-    #         id=task_id,
-    #         title=row.get("title"),
-    #         description=row.get("description"),
-    #         status=row.get("status"),
-    #         updated=row.get("updated"),
-    #         parent=parent_id,
-    #         childs=childs_ids,
-    #     )
-
-    def _build_task(self, row: dict, visited: Optional[Set[int]] = None) -> Task:
-        """Create a Task dataclass from a DB row and populate children recursively.
-
-        The `visited` set is copied and passed to recursive calls to avoid cycles.
+        Empty if the task does not exist. The result may come from the tree cache and is
+        shared between callers, so treat it as read-only.
         """
-        if visited is None:
-            visited = set()
-
-        task_id = row["id"]
-        # copy visited to avoid mutating caller state
-        local_visited = set(visited)
-        local_visited.add(task_id)
-
-        # build children
-        childs: List[Task] = []
-        for child_id in row.get("childs") or []:
-            if child_id in local_visited:
-                continue
-            child = self.get_task(child_id, local_visited)
-            if child:
-                childs.append(child)
-
-        # build parent (avoid cycles)
-        parent = None
-        parent_id = row.get("parent")
-        if parent_id and parent_id not in local_visited:
-            parent = self.get_task(parent_id, local_visited)
-
+        return await self._load_cached(id, conn, SELECT_SUBTREE, id)
+
+    async def load_trees(self, conn=None) -> Dict[int, Task]:
+        """Return all root tasks with their subtrees as a flat {id: Task} dict (cached like load_tree)."""
+        return await self._load_cached(ROOT_TREES_KEY, conn, SELECT_ROOT_TREES)
+
+    async def _get_task_cached(self, id: int, cache: Dict[int, Optional[Task]], conn=None) -> Optional[Task]:
+        """get_task memoized in a caller-owned (request-scoped) `cache`, misses included."""
+        if id not in cache:
+            cache[id] = await self.get_task(id, conn)
+        return cache[id]
+
+    async def _get_tasks_by_ids(self, ids: List[int], conn=None) -> Dict[int, asyncpg.Record]:
+        """Return plain rows (without subtrees) for `ids` as {id: row} in one query."""
+        if not ids:
+            return {}
+        async with self._connection(conn) as conn:
+            records = await conn.fetch(SELECT_TASKS_BY_IDS, list(ids))
+            return {r["id"]: r for r in records}
+
+
+    @staticmethod
+    def _build_task(row: asyncpg.Record) -> Task:
+        """Create a Task from a DB row; parent is stored as an id, childs as a list of ids."""
         return Task(
-            id=task_id,
+            id=row["id"],
             title=row.get("title"),
             description=row.get("description"),
             status=row.get("status"),
             updated=row.get("updated"),
-            parent=parent,
-            childs=childs,
+            parent=row.get("parent"),
+            childs=list(row.get("childs") or []),
         )
 
-    # ---- cycle detection helpers ----
-    def _get_parent_id(self, task_id: int) -> Optional[int]:
-        with self._cursor() as cur:
-            cur.execute("SELECT parent FROM tasks WHERE id = %s", (task_id,))
-            row = cur.fetchone()
-            return row["parent"] if row else None
+    # ---- traversal_ids helpers ----
+    async def _refresh_traversal_ids(self, conn, task_ids: List[int]) -> None:
+        """Recompute traversal_ids (path from root to node) for the subtrees of `task_ids`.
+
+        Each start node takes its parent's path, descendants are walked through the parent
+        column. Ids already on the path are skipped so an existing DB cycle cannot loop, and a
+        start node already on its parent's path (a cycle) starts a new path of its own.
+        """
+        if not task_ids:
+            return
+        await conn.execute(
+            """
+            WITH RECURSIVE sub AS (
+                SELECT t.id,
+                       CASE WHEN t.id = ANY(p.traversal_ids) THEN ARRAY[t.id]
+                            ELSE COALESCE(p.traversal_ids, '{}'::INT[]) || t.id END AS path
+                FROM tasks t LEFT JOIN tasks p ON p.id = t.parent
+                WHERE t.id = ANY($1::INT[])
+                UNION ALL
+                SELECT c.id, sub.path || c.id
+                FROM tasks c JOIN sub ON c.parent = sub.id
+                WHERE c.id <> ALL(sub.path)
+            )
+            UPDATE tasks SET traversal_ids = sub.path FROM sub WHERE tasks.id = sub.id
+            """,
+            list(task_ids),
+        )
 
-    def _is_ancestor(self, ancestor_id: int, descendant_id: Optional[int]) -> bool:
-        """Return True if `ancestor_id` appears in the parent chain of `descendant_id`.
+    # ---- locking ----
+    async def lock_tasks(
+        self, ids: List[int], conn, ancestors_of: Optional[int] = None, with_parents: bool = False
+    ) -> None:
+        """Row-lock `ids` until `conn` commits; optionally also their current parents and the
+        whole root path of `ancestors_of`.
 
-        A protection against cycles: if the DB already contains a loop we'll conservatively
-        return True to avoid creating new links that would make it worse.
+        Rows are locked in id order by one statement, so two lockers cannot deadlock each other.
+        Locking the new parent's ancestors serializes moves that together would close a cycle:
+        any such pair shares a row (the task moved by one is an ancestor of the other's target).
         """
-        if ancestor_id is None or descendant_id is None:
-            return False
-
-        seen: Set[int] = set()
-        current = descendant_id
-        while current is not None:
-            if current in seen:
-                # existing DB cycle — treat as ancestor found to be safe
-                return True
-            seen.add(current)
-            if current == ancestor_id:
-                return True
-            current = self._get_parent_id(current)
-        return False
+        await conn.execute(
+            """
+            SELECT 1 FROM tasks
+            WHERE id = ANY($1::INT[])
+               OR ($3 AND id IN (SELECT parent FROM tasks WHERE id = ANY($1::INT[])))
+               OR id = ANY(COALESCE((SELECT traversal_ids FROM tasks WHERE id = $2), '{}'::INT[]))
+            ORDER BY id
+            FOR UPDATE
+            """,
+            [i for i in ids if i is not None], ancestors_of, with_parents,
+        )
+
+    # ---- cycle detection helpers ----
+    async def is_descendant(self, ancestor_id: int, candidate_id: int, conn=None) -> bool:
+        """Return True if `candidate_id` is in the subtree of `ancestor_id` (itself included)."""
+        async with self._connection(conn) as conn:
+            found = await conn.fetchval(
+                "SELECT 1 FROM tasks WHERE id = $1 AND $2 = ANY(traversal_ids) LIMIT 1",
+                candidate_id, ancestor_id,
+            )
+            return found is not None
+
+    async def task_depth(self, task_id: int, conn=None) -> int:
+        """Return the level of `task_id` in its tree (a root is 1), or 0 if it does not exist."""
+        async with self._connection(conn) as conn:
+            depth = await conn.fetchval(
+                "SELECT array_length(traversal_ids, 1) FROM tasks WHERE id = $1", task_id
+            )
+            return depth or 0
+
+    async def subtree_height(self, task_id: int, conn=None) -> int:
+        """Return how many levels the subtree of `task_id` spans (a leaf is 1), or 0 if it does not exist."""
+        async with self._connection(conn) as conn:
+            height = await conn.fetchval(
+                """
+                SELECT max(array_length(t.traversal_ids, 1)) - array_length(r.traversal_ids, 1) + 1
+                FROM tasks r JOIN tasks t ON t.traversal_ids @> ARRAY[r.id]
+                WHERE r.id = $1
+                GROUP BY r.traversal_ids
+                """,
+                task_id,
+            )
+            return height or 0
 
     # ---- operations ----
-    def delete_task_recursive(self, task_id: int) -> None:
-        task = self.get_task(task_id)
-        if not task:
-            return
-        for child in task.childs or []:
-            self.delete_task_recursive(child.id)
-        with self._cursor() as cur:
-            cur.execute("DELETE FROM tasks WHERE id = %s", (task_id,))
-
-    def toggle_task(self, task_id: int) -> None:
-        task = self.get_task(task_id)
-        if not task:
-            return
-        new_status = not task.status
-        with self._cursor() as cur:
-            cur.execute("UPDATE tasks SET status = %s WHERE id = %s", (new_status, task_id))
-
-        if new_status:
-            for child in task.childs or []:
-                self._set_task_status_recursive(child.id, True)
-
-    def _set_task_status_recursive(self, task_id: int, status: bool) -> None:
-        with self._cursor() as cur:
-            cur.execute("UPDATE tasks SET status = %s WHERE id = %s", (status, task_id))
-        child_task = self.get_task(task_id)
-        for child in child_task.childs or []:
-            self._set_task_status_recursive(child.id, status)
-
-    def _update_childs(self, task_id: int, childs: List[int]) -> None:
+    async def delete_task_recursive(self, task_id: int, conn=None) -> None:
+        async with self.transaction(conn) as conn:
+            await conn.execute("DELETE FROM tasks WHERE traversal_ids @> ARRAY[$1::INT]", task_id)
+
+    async def toggle_task(self, task_id: int, conn=None) -> bool:
+        """Flip the task status (turning on also turns on descendants). False if not found."""
+        async with self.transaction(conn) as conn:
+            row = (await self._get_tasks_by_ids([task_id], conn)).get(task_id)
+            if not row:
+                return False
+            new_status = not row["status"]
+            if new_status:
+                await self._set_task_status_recursive(task_id, True, conn)
+            else:
+                await conn.execute("UPDATE tasks SET status = $1 WHERE id = $2", new_status, task_id)
+            return True
+
+    async def _set_task_status_recursive(self, task_id: int, status: bool, conn=None) -> None:
+        """Set `status` on the task and all of its descendants with one UPDATE."""
+        async with self.transaction(conn) as conn:
+            await conn.execute("UPDATE tasks SET status = $1 WHERE traversal_ids @> ARRAY[$2::INT]", status, task_id)
+
+    async def _update_childs(self, task_id: int, childs: List[int], conn=None) -> None:
         """Set the childs list for `task_id` while validating no cycles are created.
 
         Steps:
@@ -241,34 +388,49 @@ class Database:
           - update the childs array for task
           - set parent = task_id for newly added children
           - clear parent for removed children
+          - recompute traversal_ids of the subtrees whose parent actually changed
         """
         childs = childs or []
 
-        # validation
-        for c in childs:
-            if c == task_id:
-                raise ValueError("cannot set a task as its own child")
-            if self._is_ancestor(c, task_id):
-                raise ValueError(f"adding child {c} to {task_id} would create a cycle")
-
-        with self._cursor() as cur:
-            cur.execute("SELECT childs FROM tasks WHERE id = %s", (task_id,))
-            row = cur.fetchone()
+        async with self.transaction(conn) as conn:
+            row = await conn.fetchrow("SELECT childs, traversal_ids FROM tasks WHERE id = $1", task_id)
             prev = row["childs"] if row and row.get("childs") else []
+            ancestors = set(row["traversal_ids"] or []) if row else set()
+
+            # validation: the task's own path holds all of its ancestors
+            for c in childs:
+                if c == task_id:
+                    raise ValueError("cannot set a task as its own child")
+                if c in ancestors:
+                    raise ValueError(f"adding child {c} to {task_id} would create a cycle")
 
             # write new childs list
-            cur.execute("UPDATE tasks SET childs = %s WHERE id = %s", (childs, task_id))
+            await conn.execute("UPDATE tasks SET childs = $1 WHERE id = $2", list(childs), task_id)
 
-            # set parent on new children
-            for c in childs:
-                cur.execute("UPDATE tasks SET parent = %s WHERE id = %s", (task_id, c))
+            moved: List[int] = []
 
-            # unset parent on removed children
+            # set parent on new children
+            if childs:
+                rows = await conn.fetch(
+                    "UPDATE tasks SET parent = $1 WHERE id = ANY($2::INT[]) AND parent IS DISTINCT FROM $1"
+                    " RETURNING id",
+                    task_id, list(childs),
+                )
+                moved += [r["id"] for r in rows]
+
+            # unset parent on removed children (unless they already moved elsewhere)
             removed = set(prev) - set(childs) if prev else set()
-            for c in removed:
-                cur.execute("UPDATE tasks SET parent = NULL WHERE id = %s", (c,))
+            if removed:
+                rows = await conn.fetch(
+                    "UPDATE tasks SET parent = NULL WHERE id = ANY($1::INT[]) AND parent = $2 RETURNING id",
+                    list(removed), task_id,
+                )
+                moved += [r["id"] for r in rows]
 
-    def update_task(self, task: Task) -> Optional[Task]:
+            # only moved subtrees get new paths; children that stay keep theirs
+            await self._refresh_traversal_ids(conn, moved)
+
+    async def update_task(self, task: Task, conn=None) -> Optional[Task]:
         """
         Обновляет задачу в PostgreSQL.
         Автоматически обновляет поле updated.
@@ -279,28 +441,34 @@ class Database:
             return None
 
         task.updated = datetime.now()
-        parent_id = task.parent.id if task.parent else None
-        childs_list = [child.id for child in task.childs] if task.childs else []
+        parent_id = task.parent
+        childs_list = list(task.childs or [])
 
-        with self._cursor() as cur:
-            cur.execute(
+        async with self.transaction(conn) as conn:
+            # `old` is read from the pre-update snapshot, so old.parent is the previous parent
+            row = await conn.fetchrow(
                 """
-                UPDATE tasks
-                SET title = %s,
-                    description = %s,
-                    status = %s,
-                    updated = %s,
-                    parent = %s,
-                    childs = %s
-                WHERE id = %s
-                RETURNING id, title, description, status, updated, parent, childs
+                UPDATE tasks t
+                SET title = $1,
+                    description = $2,
+                    status = $3,
+                    updated = $4,
+                    parent = $5,
+                    childs = $6
+                FROM tasks old
+                WHERE t.id = $7 AND old.id = t.id
+                RETURNING t.id, t.title, t.description, t.status, t.updated, t.parent, t.childs,
+                          old.parent AS old_parent
                 """,
-                (task.title, task.description, task.status, task.updated, parent_id, childs_list, task.id),
+                task.title, task.description, task.status, task.updated, parent_id, childs_list, task.id,
             )
-            row = cur.fetchone()
             if not row:
                 return None
 
+            # путь меняется только при смене родителя
+            if row["old_parent"] != row["parent"]:
+                await self._refresh_traversal_ids(conn, [task.id])
+
             # Возвращаем объект Task с актуальными данными
             return self._build_task(row)
 
@@ -1,14 +1,24 @@
-from fastapi import FastAPI, HTTPException, Body
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Depends, Request, Response
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
+from pydantic import TypeAdapter, ValidationError
 from models import Task
 from typing import Optional, List
 from db_context import db
 from schemas import TaskSchema, TaskCreateSchema
 from datetime import datetime
-from converters import task_to_schema, tasks_to_schemas
+from converters import task_to_schema, tasks_to_schemas, MAX_TREE_DEPTH
 
-app = FastAPI(title="Tasks API",description="API для управления задачами ", version="1.0.0")
-db.initialize()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # пул соединений живёт столько же, сколько приложение
+    await db.connect()
+    await db.initialize()
+    yield
+    await db.close()
+
+app = FastAPI(title="Tasks API",description="API для управления задачами ", version="1.0.0", lifespan=lifespan)
 
 origins = [
     "http://localhost",
@@ -25,23 +35,50 @@ app.add_middleware(
     allow_headers=["*"],           # разрешаем все заголовки
 )
 
+# response_model остаётся для документации, а ответ сериализуется один раз через pydantic-core,
+# без повторной валидации дерева и прохода jsonable_encoder
+task_list_adapter = TypeAdapter(List[TaskSchema])
+
+def task_response(schema: TaskSchema) -> Response:
+    return Response(content=schema.model_dump_json(), media_type="application/json")
+
+def tasks_response(schemas: List[TaskSchema]) -> Response:
+    return Response(content=task_list_adapter.dump_json(schemas), media_type="application/json")
+
+# тело запроса разбирается pydantic-core прямо из байтов (model_validate_json),
+# без промежуточного json.loads -> dict; схема тела описывается в openapi_extra
+parent_id_adapter = TypeAdapter(Optional[int])
+
+def json_body(schema: dict, required: bool = True) -> dict:
+    return {"requestBody": {"content": {"application/json": {"schema": schema}}, "required": required}}
+
+async def read_body(request: Request, validate_json):
+    # пустое тело равносильно null (как Body(None) раньше)
+    body = await request.body() or b"null"
+    try:
+        return validate_json(body)
+    except ValidationError as e:
+        # тот же ответ 422, что и у встроенной проверки тела в FastAPI
+        raise RequestValidationError(
+            [{**err, "loc": ("body", *err["loc"])} for err in e.errors(include_url=False)], body=body
+        )
+
+TREE_TOO_DEEP = f"Дерево задач не может быть глубже {MAX_TREE_DEPTH} уровней"
+
+def req_cache() -> dict:
+    """Кэш задач на время одного запроса: повторные db.get_task(id) не ходят в БД"""
+    return {}
+
 @app.get(
         '/tasks', 
         response_model=List[TaskSchema], 
         summary="Получить корневые задачи", 
         description="Получить задачи без детей")
-def get_tasks():
-    tasks = db.get_tasks()
-
-    # фильтруем только корневые задачи (которые не встречаются в чужих childs)
-    all_child_ids = set()
-    for t in db.get_tasks():
-        if t.childs:
-            all_child_ids.update(child.id for child in t.childs)
-
-    roots = [t for t in tasks if t.id not in all_child_ids]
-
-    return tasks_to_schemas(roots)
+async def get_tasks():
+    # load_trees уже содержит только корневые задачи (parent IS NULL) и их поддеревья
+    nodes = await db.load_trees()
+    roots = [t for t in nodes.values() if t.parent is None]
+    return tasks_response(tasks_to_schemas(roots, nodes))
 
 
 
@@ -49,47 +86,56 @@ def get_tasks():
          response_model=TaskSchema, 
          summary="Получить задачу", 
          description="Получить задачу со всеми детьми")
-def get_task(id: int):
-    task = db.get_task(id)
-    if not task:
+async def get_task(id: int):
+    nodes = await db.load_tree(id)
+    if id not in nodes:
         raise HTTPException(status_code=404, detail="Задача не найдена")
-    return task_to_schema(task)
+    return task_response(task_to_schema(nodes[id], nodes))
 
 
 @app.post('/tasks', response_model=TaskSchema,
           summary="Создать задачу", 
-          description="Добавляет новую задачу в систему")
-def create_task(task: TaskCreateSchema, parent: Optional[int] = None):
-    # проверка родителя
-    parent_task = None
-    if parent:
-        parent_task = db.get_task(parent)
-        if not parent_task:
-            raise HTTPException(status_code=404, detail="Родительская задача не найдена")
-
-    # сохраняем новую задачу; передаём parent_task если есть
-    new_task = db.insert_task(Task(
-        id=0,  # БД сама сгенерирует
-        title=task.title,
-        description=task.description,
-        status=task.status,
-        updated=datetime.now(),
-        parent=parent_task,
-        childs=[]
-    ))
-
-    if not new_task:
-        raise HTTPException(status_code=500, detail="Не удалось создать задачу")
-
-    # если есть родитель — обновляем его childs
-    if parent_task:
-        if parent_task.childs is None:
-            parent_task.childs = []
-
-        parent_task.childs.append(new_task)
-        db._update_childs(parent_task.id, [child.id for child in parent_task.childs])
-
-    return task_to_schema(new_task)
+          description="Добавляет новую задачу в систему",
+          openapi_extra=json_body(TaskCreateSchema.model_json_schema()))
+async def create_task(request: Request, parent: Optional[int] = None):
+    task = await read_body(request, TaskCreateSchema.model_validate_json)
+
+    # вся операция в одной транзакции; строка родителя блокируется, чтобы параллельные
+    # создания под одним родителем не затирали друг другу его childs
+    async with db.transaction() as conn:
+        # проверка родителя
+        parent_task = None
+        if parent:
+            await db.lock_tasks([parent], conn)
+            parent_task = await db.get_task(parent, conn)
+            if not parent_task:
+                raise HTTPException(status_code=404, detail="Родительская задача не найдена")
+            if await db.task_depth(parent_task.id, conn) + 1 > MAX_TREE_DEPTH:
+                raise HTTPException(status_code=400, detail=TREE_TOO_DEEP)
+
+        # сохраняем новую задачу; передаём id родителя если есть
+        new_task = await db.insert_task(Task(
+            id=0,  # БД сама сгенерирует
+            title=task.title,
+            description=task.description,
+            status=task.status,
+            updated=datetime.now(),
+            parent=parent_task.id if parent_task else None,
+            childs=[]
+        ), conn)
+
+        if not new_task:
+            raise HTTPException(status_code=500, detail="Не удалось создать задачу")
+
+        # если есть родитель — обновляем его childs
+        if parent_task:
+            if parent_task.childs is None:
+                parent_task.childs = []
+
+            parent_task.childs.append(new_task.id)
+            await db._update_childs(parent_task.id, parent_task.childs, conn)
+
+    return task_response(task_to_schema(new_task))
 
 
 
@@ -97,13 +143,13 @@ def create_task(task: TaskCreateSchema, parent: Optional[int] = None):
             response_model=TaskSchema, 
             summary="Удалить задачу", 
             description="Удаляет задачу вместе с её детьми")
-def delete_task(id: int):
-    task = db.get_task(id)
-    if not task:
+async def delete_task(id: int):
+    nodes = await db.load_tree(id)
+    if id not in nodes:
         raise HTTPException(status_code=404, detail="Задача не найдена")
 
-    db.delete_task_recursive(id)
-    return task_to_schema(task)
+    await db.delete_task_recursive(id)
+    return task_response(task_to_schema(nodes[id], nodes))
 
 
 
@@ -112,62 +158,70 @@ def delete_task(id: int):
           response_model=TaskSchema, 
           summary="Переключить состояние", 
           description="переключить состояние задачи активна\неактивна. Переключить можно вместе с детьми")
-def toggle_task(id: int, with_childs: bool = False):
-    task = db.get_task(id)
-    if not task:
-        raise HTTPException(status_code=404, detail="Задача не найдена")
-
-    db.toggle_task(id)
-    return task_to_schema(db.get_task(id))  # возвращаем обновлённое дерево
-
-
-@app.post("/tasks/{id}/change-parent", response_model=TaskSchema)
-def change_parent(id: int, parent_id: Optional[int] = Body(None)):
-    task = db.get_task(id)
-    if not task:
+async def toggle_task(id: int, with_childs: bool = False):
+    if not await db.toggle_task(id):
         raise HTTPException(status_code=404, detail="Задача не найдена")
 
-    old_parent_id = task.parent
-
-    # Проверка нового родителя
-    if parent_id is not None:
-        if parent_id == task.id:
-            raise HTTPException(status_code=400, detail="Нельзя сделать себя родителем")
-
-        # Защита от циклов
-        def is_descendant(descendant_id: int, target_id: int) -> bool:
-            descendant_task = db.get_task(descendant_id)
-            if not descendant_task:
-                return False
-            if any(child.id == target_id for child in descendant_task.childs):
-                return True
-            return any(is_descendant(child.id, target_id) for child in descendant_task.childs)
-
-        if is_descendant(id, parent_id):
-            raise HTTPException(status_code=400, detail="Нельзя назначить потомка родителем задачи")
-
-    # Обновляем childs старого родителя
-    if old_parent_id:
-        old_parent_task = db.get_task(old_parent_id)
-        if old_parent_task:
-            old_parent_task.childs = [child for child in old_parent_task.childs if child.id != id]
-            db._update_childs(old_parent_id, [child.id for child in old_parent_task.childs])
-
-    # Обновляем childs нового родителя
-    if parent_id:
-        new_parent_task = db.get_task(parent_id)
-        if new_parent_task:
-            if new_parent_task.childs is None:
-                new_parent_task.childs = []
-            # Добавляем текущую задачу в список детей нового родителя
-            new_parent_task.childs.append(task)
-            db._update_childs(parent_id, [child.id for child in new_parent_task.childs])
-
-    # Обновляем самого task
-    if parent_id:
-        task.parent = new_parent_task
-    else:
-        task.parent = None
-    db.update_task(task)
-
-    return task_to_schema(db.get_task(id))
+    nodes = await db.load_tree(id)
+    return task_response(task_to_schema(nodes[id], nodes))  # возвращаем обновлённое дерево
+
+
+@app.post("/tasks/{id}/change-parent", response_model=TaskSchema,
+          openapi_extra=json_body(parent_id_adapter.json_schema(), required=False))
+async def change_parent(id: int, request: Request, cache: dict = Depends(req_cache)):
+    parent_id = await read_body(request, parent_id_adapter.validate_json)
+
+    # вся операция в одной транзакции: проверки на цикл и глубину и перенос видят одно состояние.
+    # Блокируем задачу и цепочку предков нового родителя, иначе встречные переносы
+    # (A под B и B под A) оба пройдут проверку и замкнут цикл
+    async with db.transaction() as conn:
+        await db.lock_tasks([id], conn, ancestors_of=parent_id, with_parents=True)
+        task = await db._get_task_cached(id, cache, conn)
+        if not task:
+            raise HTTPException(status_code=404, detail="Задача не найдена")
+
+        # обычно старый родитель уже заблокирован выше; повторно берём на случай,
+        # если задачу успели перенести до блокировки
+        old_parent_id = task.parent
+        if old_parent_id:
+            await db.lock_tasks([old_parent_id], conn)
+
+        # Проверка нового родителя
+        if parent_id is not None:
+            if parent_id == task.id:
+                raise HTTPException(status_code=400, detail="Нельзя сделать себя родителем")
+
+            # Защита от циклов
+            if await db.is_descendant(id, parent_id, conn):
+                raise HTTPException(status_code=400, detail="Нельзя назначить потомка родителем задачи")
+
+            # перенесённое поддерево не должно стать глубже, чем умеет отдать ответ
+            if await db.task_depth(parent_id, conn) + await db.subtree_height(id, conn) > MAX_TREE_DEPTH:
+                raise HTTPException(status_code=400, detail=TREE_TOO_DEEP)
+
+        # загружаем родителей до изменений; если старый и новый совпадают, это один объект из кэша
+        old_parent_task = await db._get_task_cached(old_parent_id, cache, conn) if old_parent_id else None
+        new_parent_task = await db._get_task_cached(parent_id, cache, conn) if parent_id else None
+
+        # Обновляем childs старого родителя
+        if old_parent_id:
+            if old_parent_task:
+                old_parent_task.childs = [child_id for child_id in old_parent_task.childs if child_id != id]
+                await db._update_childs(old_parent_id, old_parent_task.childs, conn)
+
+        # Обновляем childs нового родителя
+        if parent_id:
+            if new_parent_task:
+                if new_parent_task.childs is None:
+                    new_parent_task.childs = []
+                # Добавляем текущую задачу в список детей нового родителя
+                new_parent_task.childs.append(id)
+                await db._update_childs(parent_id, new_parent_task.childs, conn)
+
+        # Обновляем самого task
+        task.parent = new_parent_task.id if new_parent_task else None
+        await db.update_task(task, conn)
+
+    # дерево читаем после COMMIT, когда кэш уже сброшен
+    nodes = await db.load_tree(id)
+    return task_response(task_to_schema(nodes[id], nodes))
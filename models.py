@@ -5,12 +5,12 @@ from dataclasses import dataclass, field
 from datetime import datetime
 from typing import List, Optional
 
-@dataclass
+@dataclass(slots=True)
 class Task:
     id: int
     title: str
     description: Optional[str]
     status: bool
     updated: datetime
-    parent: Optional["Task"] = None     # может быть объектом или None
-    childs: List["Task"] = field(default_factory=list)  # список объектов Task
+    parent: Optional[int] = None     # id родителя или None
+    childs: List[int] = field(default_factory=list)  # список id детей
@@ -14,11 +14,8 @@ class TaskSchema(BaseModel):
     description: Optional[str]
     status: bool
     updated: datetime = Field(default_factory=datetime.now)
-    parent: Optional["TaskSchema"] = None
+    parent: Optional[int] = None
     childs: List["TaskSchema"] = []
 
-    class Config:
-        orm_mode = True
-
 
 TaskSchema.model_rebuild()
\ No newline at end of file